@@ -1,79 +1,331 @@
+import argparse
 import os
+import re
+import sys
+from datetime import date
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import lru_cache, partial
+from multiprocessing import shared_memory
 from PIL import Image, ImageDraw, ImageFont
-import exifread
-from datetime import datetime
 
-def get_exif_date(image_path):
+# EXIF 标签编号
+EXIF_IFD = 0x8769                # Exif 子IFD 指针
+TAG_DATETIME = 306               # Image DateTime
+TAG_DATETIME_ORIGINAL = 36867    # EXIF DateTimeOriginal
+TAG_DATETIME_DIGITIZED = 36868   # EXIF DateTimeDigitized
+
+# EXIF 日期格式为 "YYYY:MM:DD HH:MM:SS"，也兼容 "-" 与 "/" 分隔
+DATE_RE = re.compile(r'^(\d{4})[-:/](\d{1,2})[-:/](\d{1,2})')
+
+# 支持的图片扩展名
+IMAGE_EXTS = ('.png', '.jpg', '.jpeg', '.bmp', '.gif')
+
+# 水印位置选项
+POSITIONS = ('left-top', 'center', 'right-bottom')
+DEFAULT_POSITION = POSITIONS.index('right-bottom')
+
+# 各位置的坐标计算 (图宽, 图高, 字宽, 字高, 边距) -> (x, y)，顺序与 POSITIONS 一致
+POSITION_FUNCS = (
+    lambda img_w, img_h, text_w, text_h, pad: (pad, pad),
+    lambda img_w, img_h, text_w, text_h, pad: ((img_w - text_w) // 2, (img_h - text_h) // 2),
+    lambda img_w, img_h, text_w, text_h, pad: (img_w - text_w - pad, img_h - text_h - pad),
+)
+
+UNKNOWN_DATE = "未知日期"  # 无法获取拍摄日期时使用的默认文本
+
+# 子进程中从共享内存映射得到的水印蒙版 {(文字, 字号): 蒙版}，以及对应的共享内存块
+_shared_masks = {}
+_shared_blocks = []
+
+@lru_cache(maxsize=1)
+def find_font_file():
     """
-    读取图片的EXIF信息中的拍摄时间
+    查找水印字体文件的实际路径，每个进程只探测一次；找不到时返回 None
     """
     try:
-        with open(image_path, 'rb') as f:
-            tags = exifread.process_file(f)
-            
-        # 尝试获取拍摄时间
-        date_taken = None
-        for tag in ('EXIF DateTimeOriginal', 'EXIF DateTimeDigitized', 'Image DateTime'):
-            if tag in tags:
-                date_taken = str(tags[tag])
-                break
-                
-        if date_taken:
-            # 将日期字符串转换为datetime对象
-            dt = datetime.strptime(date_taken, '%Y:%m:%d %H:%M:%S')
-            return dt.strftime('%Y年%m月%d日')
+        return ImageFont.truetype("simhei.ttf").path
+    except OSError:
         return None
+
+@lru_cache(maxsize=16)
+def load_font(font_size):
+    """
+    加载水印字体，按字号缓存（进程池中每个子进程只加载一次；线程间共享只读使用）
+    """
+    font_file = find_font_file()
+    if font_file is not None:
+        try:
+            return ImageFont.truetype(font_file, font_size)
+        except (OSError, ValueError):
+            # 字号无效（如≤0）或字体文件无法读取时，同样退回默认字体
+            pass
+    # 如果找不到指定字体，使用默认字体
+    return ImageFont.load_default()
+
+def get_exif_date(img):
+    """
+    读取已打开图片的EXIF信息中的拍摄时间（只取需要的标签）；
+    JPEG 等只读文件头，但 PNG 的 eXIf 块不在文件头时 Pillow 会先解码整张图片
+    """
+    try:
+        exif = img.getexif()
+        # 拍摄/数字化时间位于 Exif 子IFD，仅在存在时才解析该子IFD
+        exif_ifd = exif.get_ifd(EXIF_IFD) if EXIF_IFD in exif else {}
+
+        # 尝试获取拍摄时间
+        date_taken = (exif_ifd.get(TAG_DATETIME_ORIGINAL)
+                      or exif_ifd.get(TAG_DATETIME_DIGITIZED)
+                      or exif.get(TAG_DATETIME))
+
+        # 用预编译的正则直接取出年月日
+        m = DATE_RE.match(date_taken) if isinstance(date_taken, str) else None
+        if not m:
+            return None
+        # 校验是否为真实存在的日期，"0000:00:00" 之类的占位值或 2月30日 会抛出 ValueError
+        dt = date(int(m[1]), int(m[2]), int(m[3]))
+        return f"{dt.year:04d}年{dt.month:02d}月{dt.day:02d}日"
     except:
         return None
 
-def add_watermark(image_path, text, font_size=36, color=(255, 255, 255), position='right-bottom'):
+@lru_cache(maxsize=256)
+def text_bbox(text, font_size):
+    """
+    计算文字的包围盒，相同文字/字号只计算一次
     """
-    在图片上添加水印
+    return ImageDraw.Draw(Image.new('L', (1, 1))).textbbox((0, 0), text, font=load_font(font_size))
+
+@lru_cache(maxsize=64)
+def render_date_mask(text, font_size):
     """
+    将水印文字渲染为仅包含文字区域的单通道(L)蒙版，相同文字/字号只渲染一次
+    """
+    font = load_font(font_size)
+    left, top, right, bottom = text_bbox(text, font_size)
+    mask = Image.new('L', (right - left, bottom - top), 0)
+    ImageDraw.Draw(mask).text((-left, -top), text, font=font, fill=255)
+    return mask
+
+def share_masks(texts, font_size):
+    """
+    在主进程中为每个不同的日期渲染一次蒙版并放入共享内存，返回 (共享内存块列表, 登记表)
+    """
+    blocks = []
+    registry = {}
     try:
-        # 打开图片
-        img = Image.open(image_path)
-        
-        # 创建绘图对象
-        draw = ImageDraw.Draw(img)
-        
-        # 加载字体
-        try:
-            font = ImageFont.truetype("simhei.ttf", font_size)
-        except:
-            # 如果找不到指定字体，使用默认字体
-            font = ImageFont.load_default()
-        
-        # 获取文本大小
-        text_bbox = draw.textbbox((0, 0), text, font=font)
-        text_width = text_bbox[2] - text_bbox[0]
-        text_height = text_bbox[3] - text_bbox[1]
+        for text in texts:
+            mask = render_date_mask(text, font_size)
+            data = mask.tobytes()
+            if not data:
+                continue
+            shm = shared_memory.SharedMemory(create=True, size=len(data))
+            blocks.append(shm)
+            shm.buf[:len(data)] = data
+            registry[(text, font_size)] = (shm.name, mask.size)
+    except BaseException:
+        # 中途失败时释放已创建的共享内存块，避免残留在 /dev/shm
+        release_masks(blocks)
+        raise
+    return blocks, registry
+
+def release_masks(blocks):
+    """
+    关闭并删除主进程创建的共享内存块
+    """
+    for shm in blocks:
+        shm.close()
+        shm.unlink()
+
+def init_worker(registry):
+    """
+    进程池初始化：直接映射主进程共享的水印蒙版，不复制也不重新渲染
+    """
+    for key, (name, size) in registry.items():
+        shm = shared_memory.SharedMemory(name=name)
+        _shared_blocks.append(shm)
+        _shared_masks[key] = Image.frombuffer('L', size, shm.buf, 'raw', 'L', 0, 1)
+
+def position_index(position):
+    """
+    将位置名称转换为 POSITION_FUNCS 的下标，未知名称按右下角处理
+    """
+    try:
+        return POSITIONS.index(position)
+    except ValueError:
+        return DEFAULT_POSITION
+
+def compute_position(position, img_width, img_height, text_width, text_height, padding=10):
+    """
+    计算水印左上角坐标；position 为 position_index() 返回的下标
+    """
+    return POSITION_FUNCS[position](img_width, img_height, text_width, text_height, padding)
+
+def add_watermark(img, text, font_size=36, color=(255, 255, 255), position=DEFAULT_POSITION):
+    """
+    在已打开的图片上添加水印；position 为 position_index() 返回的下标
+    """
+    try:
+        # 直接在解码后的图片上绘制，不另建全尺寸图层；
+        # 只有灰度/调色板/CMYK等无法直接绘制彩色文字的模式才转换一次
+        if img.mode not in ('RGB', 'RGBA'):
+            has_alpha = 'A' in img.mode or 'transparency' in img.info
+            img = img.convert('RGBA' if has_alpha else 'RGB')
+
+        # 获取（共享或缓存的）水印蒙版及其大小
+        mask = _shared_masks.get((text, font_size))
+        if mask is None:
+            mask = render_date_mask(text, font_size)
+        text_width, text_height = mask.size
         
         # 计算水印位置
         img_width, img_height = img.size
-        padding = 10
-        
-        if position == 'left-top':
-            x = padding
-            y = padding
-        elif position == 'center':
-            x = (img_width - text_width) // 2
-            y = (img_height - text_height) // 2
-        else:  # 默认右下角
-            x = img_width - text_width - padding
-            y = img_height - text_height - padding
+        x, y = compute_position(position, img_width, img_height, text_width, text_height)
         
-        # 绘制水印文字
-        draw.text((x, y), text, font=font, fill=color)
+        # 透过蒙版把纯色贴到文字区域
+        img.paste(color, (x, y), mask)
         
         return img
     except Exception as e:
         print(f"添加水印时出错: {str(e)}")
         return None
 
-def process_images(input_path):
+def scan_date(img_path):
+    """
+    在不解码像素的前提下获取水印日期文本（供主进程预扫描使用）；
+    无法只读文件头得到结果时返回 None，由子进程在解码时自行读取
+    """
+    try:
+        with Image.open(img_path) as img:
+            # PNG 的 eXIf 块不在文件头时，getexif() 会解码整张图片，留给子进程处理
+            if img.format == 'PNG' and 'exif' not in img.info:
+                return None
+            return get_exif_date(img) or UNKNOWN_DATE
+    except (OSError, Image.DecompressionBombError):
+        # 打不开的文件交给子进程，由其报告该文件失败
+        return None
+
+def save_image(img, output_path, quality=90):
+    """
+    按扩展名保存图片；JPEG/PNG 使用偏向编码速度的参数
+    """
+    ext = os.path.splitext(output_path)[1].lower()
+    if ext in ('.jpg', '.jpeg'):
+        # 显式指定质量，关闭 Huffman 优化与渐进式编码，4:2:0 色度抽样
+        img.save(output_path, 'JPEG', quality=quality, subsampling=2, optimize=False, progressive=False)
+    elif ext == '.png':
+        # 压缩级别1比默认的6快数倍，文件只略大
+        img.save(output_path, 'PNG', compress_level=1)
+    else:
+        img.save(output_path)
+
+def watermark_one(img_path, date_text, output_dir, font_size=36, color=(255, 255, 255), position=DEFAULT_POSITION,
+                  quality=90):
+    """
+    处理单张图片并保存到输出目录，返回是否成功（可在子进程中执行）；
+    date_text 为 None 时从图片EXIF读取
+    """
+    output_path = os.path.join(output_dir, os.path.basename(img_path))
+    try:
+        # Image.open 是惰性的：JPEG 等格式先只读文件头取拍摄日期，贴水印时才解码像素
+        with Image.open(img_path) as img:
+            if date_text is None:
+                date_text = get_exif_date(img) or UNKNOWN_DATE
+
+            # 添加水印
+            watermarked = add_watermark(img, date_text, font_size=font_size, color=color, position=position)
+            if not watermarked:
+                return False
+
+            # 保存处理后的图片
+            save_image(watermarked, output_path, quality=quality)
+    except (OSError, Image.DecompressionBombError) as e:
+        # 超大图片（像素数超过 Image.MAX_IMAGE_PIXELS 的两倍）同样只记为该文件失败
+        print(f"读写图片时出错: {str(e)}")
+        return False
+    return True
+
+def prefetch_files(paths):
+    """
+    通知内核预读所有源文件，让磁盘请求队列保持较深（仅支持 posix_fadvise 的平台，如Linux）
+    """
+    if not hasattr(os, 'posix_fadvise'):
+        return
+    for path in paths:
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except OSError:
+            continue
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+        finally:
+            os.close(fd)
+
+def iter_images(directory):
+    """
+    用一次 os.scandir 遍历目录，产出 (图片路径, 文件大小)，复用目录项自带的类型与 stat 信息
+    """
+    with os.scandir(directory) as it:
+        for entry in it:
+            if entry.name.lower().endswith(IMAGE_EXTS) and entry.is_file():
+                yield entry.path, entry.stat().st_size
+
+def parse_color(value):
+    """
+    解析 "R,G,B" 或 "(R,G,B)" 格式的颜色，返回 (R, G, B)
+    """
+    parts = value.strip().strip('()').split(',')
+    color = tuple(int(part) for part in parts)
+    if len(color) != 3 or not all(0 <= c <= 255 for c in color):
+        raise ValueError(f"无效的颜色: {value}")
+    return color
+
+def positive_int(value):
+    """
+    解析正整数（用于字体大小等参数）
+    """
+    number = int(value)
+    if number < 1:
+        raise ValueError(f"必须大于0: {value}")
+    return number
+
+def ask_options(font_size, color, position):
+    """
+    交互式询问水印参数，直接回车或输入无效时沿用传入的默认值
+    """
+    answer = input(f"请输入字体大小 (默认{font_size}): ").strip()
+    if answer:
+        try:
+            font_size = positive_int(answer)
+        except ValueError:
+            print(f"无效的字体大小，使用默认值 {font_size}")
+
+    default_color = "({},{},{})".format(*color)
+    answer = input(f"请输入颜色RGB值，格式(R,G,B) (默认{default_color}): ").strip()
+    if answer:
+        try:
+            color = parse_color(answer)
+        except ValueError:
+            print(f"无效的颜色，使用默认值 {default_color}")
+
+    answer = input(f"请输入水印位置 ({'/'.join(POSITIONS)}，默认{position}): ").strip()
+    if answer:
+        position = answer
+
+    return font_size, color, position
+
+def report_results(files, results):
+    """
+    按顺序逐个输出处理结果；results 可以是惰性迭代器，每张图片完成后立即输出
+    """
+    for img_path, ok in zip(files, results):
+        if ok:
+            print(f"已处理: {os.path.basename(img_path)}")
+        else:
+            print(f"处理失败: {os.path.basename(img_path)}")
+
+def process_images(input_path, font_size=36, color=(255, 255, 255), position='right-bottom',
+                   quality=90, interactive=False, async_io=False, workers=None, threads=False):
     """
-    处理指定路径下的所有图片
+    处理指定路径下的所有图片；interactive 为真时逐项询问水印参数
     """
     if not os.path.exists(input_path):
         print(f"错误: 路径 '{input_path}' 不存在")
@@ -85,52 +337,87 @@ def process_images(input_path):
         files = [input_path]
     else:
         base_dir = input_path
-        # 获取所有图片文件
-        files = []
-        for f in os.listdir(input_path):
-            if f.lower().endswith(('.png', '.jpg', '.jpeg', '.bmp', '.gif')):
-                files.append(os.path.join(input_path, f))
+        # 获取所有图片文件，按文件大小降序排列，让大图先开始处理，减少进程池末尾的空等
+        images = sorted(iter_images(input_path), key=lambda item: item[1], reverse=True)
+        files = [path for path, _ in images]
     
     # 创建输出目录
     output_dir = os.path.join(base_dir, os.path.basename(base_dir) + '_watermark')
     os.makedirs(output_dir, exist_ok=True)
     
-    # 处理每个图片
-    for img_path in files:
-        # 获取拍摄日期
-        date_text = get_exif_date(img_path)
-        if not date_text:
-            date_text = "未知日期"  # 如果无法获取拍摄日期，使用默认文本
-        
-        # 添加水印
-        watermarked = add_watermark(
-            img_path,
-            date_text,
-            font_size=int(input("请输入字体大小 (默认36): ") or 36),
-            color=eval(input("请输入颜色RGB值，格式(R,G,B) (默认白色(255,255,255)): ") or "(255,255,255)"),
-            position=input("请输入水印位置 (left-top/center/right-bottom，默认right-bottom): ") or "right-bottom"
-        )
-        
-        if watermarked:
-            # 保存处理后的图片
-            output_path = os.path.join(output_dir, os.path.basename(img_path))
-            watermarked.save(output_path)
-            print(f"已处理: {os.path.basename(img_path)}")
-        else:
-            print(f"处理失败: {os.path.basename(img_path)}")
+    if not files:
+        print(f"未找到图片: {input_path}")
+        return
+
+    # 后台预读所有源文件（交互模式下与等待用户输入同时进行）
+    if async_io:
+        prefetch_files(files)
+
+    # 获取水印参数（所有图片共用）
+    if interactive:
+        font_size, color, position = ask_options(font_size, color, position)
+
+    # 位置名称只解析一次，之后按下标查表
+    worker = partial(watermark_one, output_dir=output_dir, font_size=font_size, color=color,
+                     position=position_index(position),
+                     quality=quality)
+
+    # 各图片相互独立，多张时分发到线程池或进程池并行处理；
+    # 未指定 workers 时传 None，由线程池/进程池按各自的规则（含平台上限）决定
+    if len(files) == 1 or workers == 1:
+        report_results(files, (worker(img_path, None) for img_path in files))
+    elif threads:
+        # 线程直接共享已加载的字体与蒙版缓存，无需启动进程、序列化参数；
+        # Pillow 在解码/编码时会释放GIL
+        with ThreadPoolExecutor(max_workers=workers) as ex:
+            report_results(files, ex.map(worker, files, [None] * len(files)))
+    else:
+        # Windows 上进程池最多支持61个子进程
+        max_workers = min(workers, 61) if workers and sys.platform == 'win32' else workers
+        # 主进程先只读文件头取出所有日期，每个不同的日期只渲染一次蒙版，
+        # 经共享内存交给所有子进程（预扫描得不到日期的图片由子进程自行读取）
+        dates = [scan_date(img_path) for img_path in files]
+        blocks, registry = share_masks({d for d in dates if d is not None}, font_size)
+        try:
+            # 逐个分发(chunksize=1)，空闲的子进程随时领取下一张
+            with ProcessPoolExecutor(max_workers=max_workers,
+                                     initializer=init_worker, initargs=(registry,)) as ex:
+                report_results(files, ex.map(worker, files, dates, chunksize=1))
+        finally:
+            release_masks(blocks)
 
 def main():
+    parser = argparse.ArgumentParser(description="图片水印添加工具")
+    parser.add_argument("input_path", nargs="?", help="图片文件或目录路径（不提供时进入交互模式）")
+    parser.add_argument("--font-size", type=positive_int, default=36, help="字体大小（默认36）")
+    parser.add_argument("--color", type=parse_color, default=(255, 255, 255), help="颜色RGB值，格式R,G,B（默认白色255,255,255）")
+    parser.add_argument("--position", choices=POSITIONS, default='right-bottom', help="水印位置（默认right-bottom）")
+    parser.add_argument("--quality", type=int, default=90, help="JPEG输出质量1-95（默认90）")
+    parser.add_argument("--interactive", action="store_true", help="逐项询问路径以外的水印参数")
+    parser.add_argument("--async-io", action="store_true", help="预先并发读取所有源文件（仅Linux等支持posix_fadvise的系统）")
+    parser.add_argument("--workers", type=int, help="并行处理的进程/线程数（默认由进程池/线程池自动决定）")
+    parser.add_argument("--threads", action="store_true", help="使用线程池代替进程池（适合图片较少或以编解码为主的批次）")
+    args = parser.parse_args()
+    if not 1 <= args.quality <= 95:
+        parser.error("--quality 必须在1到95之间")
+    if args.workers is not None and args.workers < 1:
+        parser.error("--workers 必须大于0")
+
     print("图片水印添加工具")
     print("=" * 30)
     
-    # 获取用户输入
-    input_path = input("请输入图片文件或目录路径: ").strip('"')  # 去除可能的引号
+    # 获取用户输入；未在命令行给出路径时进入交互模式
+    input_path = args.input_path
+    interactive = args.interactive or not input_path
+    if not input_path:
+        input_path = input("请输入图片文件或目录路径: ").strip('"')  # 去除可能的引号
     
     if not input_path:
         print("错误: 请提供有效的路径")
         return
     
-    process_images(input_path)
+    process_images(input_path, font_size=args.font_size, color=args.color, position=args.position,
+                   quality=args.quality, interactive=interactive, async_io=args.async_io, workers=args.workers, threads=args.threads)
     print("处理完成!")
 
 if __name__ == "__main__":